@@ -4,22 +4,67 @@
 
 '''
 
+from array import array
+from bisect import bisect_left
 import datetime
+import math
+import os
 import sqlite3
 
-# Number of seconds in 365.25 years (1 Julian year):
-SECS_IN_YEAR = 31557600
+# Number of days in 1 Julian year:
+DAYS_IN_YEAR = 365.25
+_YEARS_PER_DAY = 1 / DAYS_IN_YEAR
 
 LIGHT_YEARS_IN_1_PARSEC = 3.26163344
 
+LIGHT_DAYS_IN_1_PARSEC = LIGHT_YEARS_IN_1_PARSEC * DAYS_IN_YEAR
+
+# Stars with a B-V color index below these are "blue" and "yellow":
+BLUE_MAX_COLOR_INDEX = 0.35
+YELLOW_MAX_COLOR_INDEX = 0.8
+
+# Stars fainter than this apparent magnitude can't be seen with the naked eye:
+MAX_VISIBLE_MAGNITUDE = 6.5
+
+DB_PATH = 'stars.db'
+
+# Pragmas applied to every connection, to keep as much of the database in
+# memory as we can:
+_CONNECT_PRAGMAS = (
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+)
+
+# The columns of the stars table that Star's constructor takes, in the order
+# it takes them:
+_STAR_COLUMNS = ("id, hip_id, gl_id, proper_name, distance, magnitude, "
+                 "color_index, constellation")
+
+# Nearest-star queries. Each one is a single probe of idx_stars_distance
+# (which stars.db ships with), rather than a sort of the whole table:
+_STMT_BELOW = "SELECT " + _STAR_COLUMNS + " FROM stars WHERE distance <= ? ORDER BY distance DESC LIMIT 1"
+_STMT_ABOVE = "SELECT " + _STAR_COLUMNS + " FROM stars WHERE distance >= ? ORDER BY distance ASC LIMIT 1"
+_STMT_BY_ROWID = "SELECT " + _STAR_COLUMNS + " FROM stars WHERE rowid = ?"
+
 # Standard constellation abbreviations, as dict:
 CONST_ABBREV = {"And": "Andromeda","Ant": "Antlia","Aps": "Apus","Aqr": "Aquarius","Aql": "Aquila","Ara": "Ara","Ari": "Aries","Aur": "Auriga","Boo": "Boötes","Cae": "Caelum","Cam": "Camelopardalis","Cnc": "Cancer","CVn": "Canes Venatici","CMa": "Canis Major","CMi": "Canis Minor","Cap": "Capricornus","Car": "Carina","Cas": "Cassiopeia","Cen": "Centaurus","Cep": "Cepheus","Cet": "Cetus","Cha": "Chamaeleon","Cir": "Circinus","Col": "Columba", "Com": "Coma Berenices","CrA": "Corona Australis","CrB": "Corona Borealis","Crv": "Corvus","Crt": "Crater","Cru": "Crux","Cyg": "Cygnus","Del": "Delphinus","Dor": "Dorado","Dra": "Draco","Equ": "Equuleus","Eri": "Eridanus","For": "Fornax","Gem": "Gemini","Gru": "Grus","Her": "Hercules","Hor": "Horologium","Hya": "Hydra","Hyi": "Hydrus","Ind": "Indus","Lac": "Lacerta","Leo": "Leo","LMi": "Leo Minor","Lep": "Lepus","Lib": "Libra","Lup": "Lupus","Lyn": "Lynx","Lyr": "Lyra","Men": "Mensa","Mic": "Microscopium","Mon": "Monoceros","Mus": "Musca","Nor": "Norma","Oct": "Octans","Oph": "Ophiuchus","Ori": "Orion","Pav": "Pavo","Peg": "Pegasus","Per": "Perseus","Phe": "Phoenix","Pic": "Pictor","Psc": "Pisces","PsA": "Piscis Austrinus","Pup": "Puppis","Pyx": "Pyxis","Ret": "Reticulum","Sge": "Sagitta (not to be confused with Sagittarius)","Sgr": "Sagittarius","Sco": "Scorpius","Scl": "Sculptor","Sct": "Scutum","Ser": "Serpens","Sex": "Sextans","Tau": "Taurus","Tel": "Telescopium","Tri": "Triangulum","TrA": "Triangulum Australe","Tuc": "Tucana","UMa": "Ursa Major","UMi": "Ursa Minor","Vel": "Vela","Vir": "Virgo","Vol": "Volans","Vul": "Vulpecula"}
 
-class Star(object):
+# Every constellation abbreviation, and its full name, each preceded by ''
+# for "unknown". Index into these with the constellation codes stored in a
+# StarTable:
+CONST_CODES = ('',) + tuple(CONST_ABBREV)
+CONST_NAMES = ('',) + tuple(CONST_ABBREV.values())
+_CONST_CODE_OF = {abbrev: code for code, abbrev in enumerate(CONST_CODES)}
+
+class Star:
     """
     A class representing a star in the galaxy. Designed for data from
     the HYG Star Database: github.com/astronexus/HYG-Database
     """
+    __slots__ = ("_database_id", "_hip_id", "_gl_id", "_proper_name",
+                 "_distance", "_distance_ly", "_magnitude", "_color",
+                 "_constellation")
+
     def __init__(self, database_id, hip_id, gl_id, proper_name, distance,
                  magnitude, color, constellation):
         """
@@ -43,18 +88,12 @@ class Star(object):
         self._database_id = database_id
         self._gl_id = gl_id
         self._distance = distance
+        self._distance_ly = distance * LIGHT_YEARS_IN_1_PARSEC
         self._proper_name = proper_name
         self._magnitude = magnitude
         self._color = color
         self._constellation = constellation
-
-        if hip_id != "":
-            self._hip_id = "HIP " + str(hip_id)
-            # The HIP ID is simply recorded as a number in the HYG database.
-            # This is too ambiguous to serve as a unique identifier in most
-            # other contexts, so we prefix it with "HIP ".
-        else:
-            self._hip_id = ""
+        self._hip_id = hip_id
 
     def get_color(self):
         """
@@ -63,9 +102,9 @@ class Star(object):
         If there's no record of a star's color, we just choose red.
         """
         if self._color != '':
-            if self._color < 0.35:
+            if self._color < BLUE_MAX_COLOR_INDEX:
                 return 'blue'
-            if self._color < 0.8:
+            if self._color < YELLOW_MAX_COLOR_INDEX:
                 return 'yellow'
         return 'red'
     
@@ -86,7 +125,7 @@ class Star(object):
         Returns the constellation in which the star is located, if there is
         record of it. Otherwise, returns an empty string.
         """
-        return CONST_ABBREV[self._constellation]
+        return CONST_ABBREV.get(self._constellation, '')
 
     def is_visible(self):
         """
@@ -96,7 +135,7 @@ class Star(object):
         less than 6.5, which is the criteria for visibility used by the
         "apparent magnitude" page on Wikipedia.
         """
-        return self._magnitude < 6.5
+        return self._magnitude < MAX_VISIBLE_MAGNITUDE
 
     def get_identifier(self):
         """
@@ -108,14 +147,17 @@ class Star(object):
         interchangeably, so it shouldn't really matter which kind we get here.
         """
         if self._hip_id != "":
-            return self._hip_id
+            # The HIP ID is simply recorded as a number in the HYG database.
+            # This is too ambiguous to serve as a unique identifier in most
+            # other contexts, so we prefix it with "HIP ".
+            return f"HIP {self._hip_id}"
         return self._gl_id
 
     def get_distance_in_lightyears(self):
         """
         Returns the star's distance from Earth in light years.
         """
-        return self._distance * LIGHT_YEARS_IN_1_PARSEC
+        return self._distance_ly
         
     def when_will_light_hit(self, emit_date):
         """
@@ -126,42 +168,210 @@ class Star(object):
         it means that the light that left the star when you were born will
         hit Earth today.
         """
-        light_years_traveled = years_since_date(emit_date)
-        timedelta = datetime.timedelta(days = (self.get_distance_in_lightyears() - light_years_traveled) * 365.25)
-        return (datetime.datetime.now() + timedelta).date()
+        return _arrival_date(emit_date, self._distance)
         
 
-def years_since_date(date):
+def _arrival_date(emit_date, distance):
+    """
+    Returns the date on which light that left a star distance parsecs away on
+    emit_date reaches Earth, rounded to the nearest day.
+    """
+    travel_days = round(distance * LIGHT_DAYS_IN_1_PARSEC)
+    return emit_date + datetime.timedelta(days = travel_days)
+
+def _nearest_index(values, target):
+    """
+    Returns the index of the element of values closest to target.
+    values must be sorted and non-empty.
+    """
+    i = bisect_left(values, target)
+    if i == len(values) or (i > 0 and target - values[i-1] < values[i] - target):
+        i -= 1
+    return i
+
+class StarTable:
+    """
+    The whole star catalog, held column by column rather than as one Star
+    object per row. Use this for questions about many stars at once, where
+    building a Star for every row would be wasteful, or to answer repeated
+    nearest-star lookups with a binary search instead of a query.
+
+    Rows are sorted by distance. Unknown color indices are stored as NaN, and
+    constellations are stored as indices into CONST_CODES and CONST_NAMES.
+    """
+    def __init__(self, db_cursor):
+        """
+        Args:
+            db_cursor: The SQLite cursor connected to the stars database
+        """
+        self._rowids = array('q')
+        self._distances = array('d')
+        self._distances_ly = array('d')
+        self._magnitudes = array('d')
+        self._colors = array('d')
+        self._constellations = array('B')
+        for rowid, distance, magnitude, color, constellation in db_cursor.execute(
+                "SELECT rowid, distance, magnitude, color_index, constellation "
+                "FROM stars ORDER BY distance"):
+            self._rowids.append(rowid)
+            self._distances.append(distance)
+            self._distances_ly.append(distance * LIGHT_YEARS_IN_1_PARSEC)
+            self._magnitudes.append(magnitude)
+            self._colors.append(color if color != '' else math.nan)
+            self._constellations.append(_CONST_CODE_OF.get(constellation, 0))
+
+    def __len__(self):
+        return len(self._rowids)
+
+    def nearest_rowid(self, parsecs):
+        """
+        Returns the rowid of the star whose distance is closest to parsecs.
+        """
+        return self._rowids[_nearest_index(self._distances, parsecs)]
+
+    def get_rowids(self):
+        """
+        Returns each star's rowid in the stars database, for fetching the
+        full record of any star of interest.
+        """
+        return self._rowids
+
+    def get_colors(self):
+        """
+        Returns a list of "blue", "yellow", or "red", one per star, by the
+        same rules as Star.get_color.
+        """
+        return ['blue' if c < BLUE_MAX_COLOR_INDEX
+                else 'yellow' if c < YELLOW_MAX_COLOR_INDEX
+                else 'red'
+                for c in self._colors]  # NaN compares False, so unknown is red
+
+    def get_visible(self):
+        """
+        Returns a list of booleans, one per star, by the same rule as
+        Star.is_visible.
+        """
+        return [m < MAX_VISIBLE_MAGNITUDE for m in self._magnitudes]
+
+    def get_distances(self):
+        """
+        Returns each star's distance from Earth in parsecs.
+        """
+        return self._distances
+
+    def get_distances_in_lightyears(self):
+        """
+        Returns each star's distance from Earth in light years.
+        """
+        return self._distances_ly
+
+    def get_constellation_codes(self):
+        """
+        Returns each star's constellation, as an index into CONST_CODES and
+        CONST_NAMES.
+        """
+        return self._constellations
+
+    def get_constellations(self):
+        """
+        Returns a list of the constellation each star is located in, by the
+        same rules as Star.get_constellation.
+        """
+        return [CONST_NAMES[code] for code in self._constellations]
+
+
+def years_since_date(date, today=None):
     """
     date: A date, as a datetime.date object
+    today: Optionally, today's date as a datetime.date object, to save
+        reading the clock again.
     Returns: The amount of time that has passed since that date, in years
     """
-    return (datetime.datetime.now().date() - date).total_seconds() / SECS_IN_YEAR
+    if today is None:
+        today = datetime.date.today()
+    return (today - date).days * _YEARS_PER_DAY
+
+def when_will_light_hit_batch(emit_dates, distances):
+    """
+    Star.when_will_light_hit for many emit dates and stars at once, pairing
+    up emit_dates[i] with distances[i].
+    Args:
+        emit_dates: An iterable of datetime.date objects
+        distances: An iterable of star distances from Earth in parsecs, such
+            as a StarTable's distance column
+    Returns: A list of datetime.date objects
+    """
+    return [_arrival_date(emit_date, distance)
+            for emit_date, distance in zip(emit_dates, distances)]
 
-def get_star_from_years(light_years, db_cursor):
+def get_star_from_years(light_years, db_cursor, star_table=None):
     """
     Returns the star closest to light_years light years away.
     TODO: Check exactly what the max searchable value is
     Args:
         years: a number of years (max value: at least 100)
         db_cursor: The SQLite cursor connected to the stars database
+        star_table: Optionally, a StarTable built from the same database.
+            Worth building if you're going to look up many stars.
+    """
+    parsecs = light_years/LIGHT_YEARS_IN_1_PARSEC
+    if star_table is not None:
+        rowid = star_table.nearest_rowid(parsecs)
+        return Star(*db_cursor.execute(_STMT_BY_ROWID, (rowid,)).fetchone())
+    below = db_cursor.execute(_STMT_BELOW, (parsecs,)).fetchone()
+    above = db_cursor.execute(_STMT_ABOVE, (parsecs,)).fetchone()
+    # Column 4 is the distance, in parsecs:
+    row = min((r for r in (below, above) if r is not None),
+              key=lambda r: abs(r[4] - parsecs))
+    return Star(*row)
+
+def _parse_mdy(date_str):
+    """
+    Parses a date written as mm/dd/yyyy into a datetime.date object. Raises
+    ValueError if date_str isn't a valid date in that form.
+    """
+    parts = date_str.split("/")
+    if (len(parts) != 3
+            or not all(p.isascii() and p.isdigit() for p in parts)
+            or not 1 <= len(parts[0]) <= 2
+            or not 1 <= len(parts[1]) <= 2
+            or len(parts[2]) != 4):
+        raise ValueError("date %r does not match format mm/dd/yyyy" % date_str)
+    month, day, year = parts
+    return datetime.date(int(year), int(month), int(day))
+
+def connect(path=DB_PATH):
+    """
+    Opens a read-only connection to the stars database at path.
+
+    The database is opened as immutable, so SQLite takes no locks and never
+    checks whether the file has changed. Don't modify it while connected.
     """
-    db_cursor.execute("SELECT * FROM stars ORDER BY ABS(? - distance) LIMIT 1", (light_years/LIGHT_YEARS_IN_1_PARSEC,))
-    return Star(*db_cursor.fetchone())
+    # Only these characters are special in the path part of an SQLite URI.
+    # Quoting them by hand saves importing urllib on every run:
+    quoted = os.fspath(path).replace("%", "%25").replace("?", "%3f").replace("#", "%23")
+    uri = "file:" + quoted + "?mode=ro&immutable=1"
+    conn = sqlite3.connect(uri, uri=True, isolation_level=None)
+    for pragma in _CONNECT_PRAGMAS:
+        conn.execute(pragma)
+    return conn
 
 def main():
-    with sqlite3.connect('stars.db') as conn:
-        c = conn.cursor()
-        date_str = input("Enter your birthday (mm/dd/yyyy): ")
-        date_object = datetime.datetime.strptime(date_str, "%m/%d/%Y").date()
-        star = get_star_from_years(years_since_date(date_object), c)
-        print("Your current birth star is " + star.get_identifier() + ".")
-        future_tense_modifier = ""
-        if years_since_date(star.when_will_light_hit(date_object)) < 0:
-            # Date is in the future
-            future_tense_modifier = "will "
-        print("The light that left this star when you were born " +
-              future_tense_modifier + "hit the earth on " + str(star.when_will_light_hit(date_object)))
+    date_str = input("Enter your birthday (mm/dd/yyyy): ")
+    date_object = _parse_mdy(date_str)
+    today = datetime.date.today()
+    conn = connect()
+    try:
+        star = get_star_from_years(years_since_date(date_object, today), conn.cursor())
+    finally:
+        conn.close()
+    print("Your current birth star is " + star.get_identifier() + ".")
+    hit_date = star.when_will_light_hit(date_object)
+    future_tense_modifier = ""
+    if hit_date > today:
+        future_tense_modifier = "will "
+    print("The light that left this star when you were born " +
+          future_tense_modifier + "hit the earth on " + str(hit_date))
 
 if __name__ == "__main__":
     main()